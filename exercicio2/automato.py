@@ -1,23 +1,41 @@
 
+from collections import deque
 from dataclasses import dataclass
-import re
-from typing import Dict, FrozenSet, Generator, Iterable, List, Set, Tuple, Union
+from typing import AbstractSet, Deque, Dict, FrozenSet, Generator, Iterable, List, Set, Tuple, Union
 
 
 Estado = str
 Transicao = Tuple[Estado, str, Estado]
 MapaDeTransicao = Dict[Tuple[Estado, str], Set[Estado]]
+MapaDeterministico = Dict[Tuple[Estado, str], Estado]
 
 Epsilon = "&"
 
+_VAZIO: FrozenSet[Estado] = frozenset()
+
+_ESPACOS = str.maketrans("", "", " \t\r\n\f\v")
+
 
 def unir_estados(estados: Iterable[Estado]) -> str:
     """Retorna a representação em string de um conjunto de estados."""
 
     return "{" + "".join(sorted(estados)) + "}"
 
+def bits_ligados(mascara: int) -> Generator[int, None, None]:
+    """Retorna um gerador que percorre os índices dos bits ligados de uma máscara."""
+
+    while mascara:
+        bit = mascara & -mascara
+        yield bit.bit_length() - 1
+        mascara ^= bit
+
 @dataclass(init=False)
 class AutomatoFinito:
+    __slots__ = (
+        "estados", "estado_inicial", "estados_finais", "alfabeto", "mapa_transicoes",
+        "mapa_transicoes_det",
+    )
+
     estados: FrozenSet[Estado]
     estado_inicial: Estado
     estados_finais: FrozenSet[Estado]
@@ -34,17 +52,18 @@ class AutomatoFinito:
         transicoes = tuple(transicoes)
         estados_finais = frozenset(estados_finais)
 
-        self.estados = frozenset([*self.pegar_estados(transicoes), estado_inicial, *estados_finais])
+        self.estados = self.pegar_estados(transicoes) | {estado_inicial,} | estados_finais
         self.estado_inicial = estado_inicial
         self.estados_finais = estados_finais
         self.alfabeto = frozenset(alfabeto) - {Epsilon,}
         self.mapa_transicoes = self.criar_mapa_de_transicao(transicoes)
+        self.mapa_transicoes_det = self.criar_mapa_deterministico(self.mapa_transicoes)
 
     @classmethod
     def pegar_estados(cls, transicoes: Iterable[Transicao]) -> FrozenSet[Estado]:
         """Pega os estados utilizados em um conjunto de transições."""
 
-        estados = set()
+        estados: Set[Estado] = set()
 
         for origem, _, destino in transicoes:
             estados.add(origem)
@@ -69,11 +88,47 @@ class AutomatoFinito:
         
         return mapa
 
-    def transicao(self, origem: Estado, simbolo: str) -> FrozenSet[Estado]:
-        """Retorna o estado de destino dado um estado de origem e um símbolo de leitura."""
+    @classmethod
+    def criar_mapa_deterministico(cls, mapa: MapaDeTransicao) -> Union[MapaDeterministico, None]:
+        """
+        Cria um dicionário que mapeia um par de estado e símbolo de leitura
+        diretamente para o seu único estado de destino. Retorna None se o mapa
+        de transições não for determinístico.
+        """
+
+        mapa_det: MapaDeterministico = {}
+
+        for (origem, simbolo), destinos in mapa.items():
+            if simbolo == Epsilon or len(destinos) != 1:
+                return None
+
+            destino, = destinos
+            mapa_det[(origem, simbolo)] = destino
+
+        return mapa_det
+
+    def transicao(self, origem: Estado, simbolo: str) -> AbstractSet[Estado]:
+        """
+        Retorna os estados de destino dado um estado de origem e um símbolo de leitura.
+        O conjunto retornado é o próprio conjunto do mapa de transições e não deve ser
+        modificado.
+        """
 
         chave = (origem, simbolo)
-        return frozenset(self.mapa_transicoes.get(chave, set()))
+        return self.mapa_transicoes.get(chave) or _VAZIO
+
+    def transicao_deterministica(self, origem: Estado, simbolo: str) -> Union[Estado, None]:
+        """
+        Retorna o estado de destino dado um estado de origem e um símbolo de leitura,
+        ou None se não houver transição. Em autômatos não-determinísticos, retorna
+        qualquer um dos estados de destino.
+        """
+
+        if self.mapa_transicoes_det is not None:
+            return self.mapa_transicoes_det.get((origem, simbolo))
+
+        destinos = self.transicao(origem, simbolo)
+        return next(iter(destinos)) if destinos else None
 
     def transicoes(self) -> Generator[Transicao, None, None]:
         """Retorna um gerador que percorre as transições do autômato."""
@@ -90,30 +145,94 @@ class AutomatoFinito:
         """
 
         alcancados: Set[Estado] = set([estado])
-        restantes: Set[Estado] = set([estado])
+        restantes: Deque[Estado] = deque([estado])
 
         simbolos = {simbolo,} if simbolo is not None else self.alfabeto
 
         while restantes:
-            estado = restantes.pop()
+            estado = restantes.popleft()
 
             for s in simbolos:
-                destinos = self.transicao(estado, s)
+                novos = self.transicao(estado, s) - alcancados
 
-                restantes.update(d for d in destinos if d not in alcancados)
-                alcancados.update(destinos)
+                restantes.extend(novos)
+                alcancados |= novos
         
         return frozenset(alcancados)
 
-    def calcular_epsilon_fecho(self):
+    def calcular_epsilon_fecho(self) -> Dict[Estado, FrozenSet[Estado]]:
         """
         Calcula os estados alcançados por epsilon para todos os estados do autômato.
+
+        As componentes fortemente conexas do grafo de transições por epsilon são
+        encontradas pelo algoritmo de Tarjan, que as produz em ordem topológica
+        reversa. Assim, o fecho de cada componente é a união dos seus estados
+        com os fechos, já calculados, das componentes sucessoras.
         """
 
+        adjacentes = {estado: self.transicao(estado, Epsilon) for estado in self.estados}
+
         resultado: Dict[Estado, FrozenSet[Estado]] = {}
 
-        for estado in self.estados:
-            resultado[estado] = self.pegar_alcancaveis(estado, Epsilon)
+        indice: Dict[Estado, int] = {}
+        menor: Dict[Estado, int] = {}
+        pilha: List[Estado] = []
+        na_pilha: Set[Estado] = set()
+
+        for raiz in self.estados:
+            if raiz in indice:
+                continue
+
+            indice[raiz] = menor[raiz] = len(indice)
+            pilha.append(raiz)
+            na_pilha.add(raiz)
+
+            # pilha explícita de (estado, iterador dos vizinhos restantes)
+            chamadas = [(raiz, iter(adjacentes[raiz]))]
+
+            while chamadas:
+                estado, vizinhos = chamadas[-1]
+
+                for vizinho in vizinhos:
+                    if vizinho not in indice:
+                        indice[vizinho] = menor[vizinho] = len(indice)
+                        pilha.append(vizinho)
+                        na_pilha.add(vizinho)
+
+                        chamadas.append((vizinho, iter(adjacentes[vizinho])))
+                        break
+
+                    if vizinho in na_pilha:
+                        menor[estado] = min(menor[estado], indice[vizinho])
+                else:
+                    chamadas.pop()
+
+                    if chamadas:
+                        anterior, _ = chamadas[-1]
+                        menor[anterior] = min(menor[anterior], menor[estado])
+
+                    if menor[estado] != indice[estado]:
+                        continue
+
+                    # desempilha a componente cuja raiz é este estado
+                    componente: List[Estado] = []
+                    while True:
+                        membro = pilha.pop()
+                        na_pilha.discard(membro)
+                        componente.append(membro)
+
+                        if membro == estado:
+                            break
+
+                    alcancados = set(componente)
+                    for membro in componente:
+                        for destino in adjacentes[membro]:
+                            if destino in resultado:
+                                alcancados |= resultado[destino]
+
+                    fecho = frozenset(alcancados)
+                    for membro in componente:
+                        resultado[membro] = fecho
 
         return resultado
 
@@ -122,59 +241,117 @@ class AutomatoFinito:
 
         fecho = self.calcular_epsilon_fecho()
 
-        conjunto_inicial = fecho[self.estado_inicial]
-        inicial = unir_estados(conjunto_inicial)
-        transicoes: List[Transicao] = []
-        finais: Set[Estado] = set()
+        # cada estado recebe um índice e cada conjunto de estados é representado
+        # por um inteiro cujo i-ésimo bit indica a presença do estado de índice i.
+        # os índices seguem a ordem lexicográfica dos estados, então os bits de um
+        # conjunto já são percorridos na ordem em que o seu nome é montado
+        estados = tuple(sorted(self.estados))
+        indice_de = {estado: i for i, estado in enumerate(estados)}
 
-        visitados: Set[FrozenSet[Estado]] = set()
-        restantes: Set[FrozenSet[Estado]] = set([conjunto_inicial])
+        def mascara_de(conjunto: Iterable[Estado]) -> int:
+            mascara = 0
+            for estado in conjunto:
+                mascara |= 1 << indice_de[estado]
+            return mascara
 
-        while restantes:
-            conjunto_origem = restantes.pop()
-            origem = unir_estados(conjunto_origem)
+        fechos = [mascara_de(fecho[estado]) for estado in estados]
+        finais_mascara = mascara_de(self.estados_finais)
+
+        simbolos = tuple(self.alfabeto)
+        indice_simbolo = {simbolo: j for j, simbolo in enumerate(simbolos)}
 
-            if conjunto_origem in visitados:
+        # tabela densa, indexada por [estado][símbolo], com a máscara da
+        # união dos fechos dos destinos de cada estado por cada símbolo
+        movimentos: List[List[int]] = [[0] * len(simbolos) for _ in estados]
+
+        for (estado_origem, simbolo), estados_destino in self.mapa_transicoes.items():
+            if simbolo not in indice_simbolo:
                 continue
-            visitados.add(conjunto_origem)
 
-            for simbolo in self.alfabeto:
-                conjunto_destino: Set[Estado] = set()
+            mascara = 0
+            for estado_destino in estados_destino:
+                mascara |= fechos[indice_de[estado_destino]]
+
+            movimentos[indice_de[estado_origem]][indice_simbolo[simbolo]] = mascara
+
+        # cada conjunto descoberto recebe um índice único,
+        # junto com o seu nome, calculado uma única vez
+        indices: Dict[int, int] = {}
+        conjuntos: List[int] = []
+        nomes: List[str] = []
+
+        def internar(conjunto: int) -> int:
+            indice = indices.setdefault(conjunto, len(conjuntos))
+
+            if indice == len(conjuntos):
+                conjuntos.append(conjunto)
+                nomes.append(unir_estados(estados[i] for i in bits_ligados(conjunto)))
 
-                for estado in conjunto_origem:
-                    destinos = self.transicao(estado, simbolo)
+            return indice
 
-                    for destino in destinos:
-                        conjunto_destino.update(estado for estado in fecho[destino])
-                
+        inicial = internar(fechos[indice_de[self.estado_inicial]])
+        transicoes: List[Transicao] = []
+        finais: Set[Estado] = set()
+
+        visitados: Set[int] = set([inicial])
+        restantes: Deque[int] = deque([inicial])
+
+        while restantes:
+            origem = restantes.popleft()
+            conjunto_origem = conjuntos[origem]
+
+            # une as linhas da tabela de todos os estados do conjunto
+            destinos_por_simbolo = [0] * len(simbolos)
+            for i in bits_ligados(conjunto_origem):
+                for j, mascara in enumerate(movimentos[i]):
+                    destinos_por_simbolo[j] |= mascara
+
+            for simbolo, conjunto_destino in zip(simbolos, destinos_por_simbolo):
                 if not conjunto_destino:
                     continue
 
-                destino = unir_estados(conjunto_destino)
+                destino = internar(conjunto_destino)
 
-                transicao: Transicao = (origem, simbolo, destino)
+                transicao: Transicao = (nomes[origem], simbolo, nomes[destino])
                 transicoes.append(transicao)
 
-                if frozenset(conjunto_destino) not in visitados:
-                    restantes.add(frozenset(conjunto_destino))
-            
-            if any(estado in self.estados_finais for estado in conjunto_origem):
-                finais.add(origem)
-        
-        return AutomatoFinito(inicial, finais, self.alfabeto, transicoes)
+                if destino not in visitados:
+                    visitados.add(destino)
+                    restantes.append(destino)
+
+            if conjunto_origem & finais_mascara:
+                finais.add(nomes[origem])
+
+        return AutomatoFinito(nomes[inicial], finais, self.alfabeto, transicoes)
     
     def pegar_estados_produtivos(self) -> FrozenSet[Estado]:
-        """Retorna o conjunto de estados que alcançam pelo menos um estado de aceitação."""
+        """
+        Retorna o conjunto de estados que alcançam pelo menos um estado de aceitação.
+        Realiza uma única busca em largura no grafo reverso de transições, partindo
+        de todos os estados de aceitação.
+        """
 
-        resultado: List[Estado] = []
+        # mapa de cada estado para os estados que transitam para ele
+        anteriores: Dict[Estado, Set[Estado]] = {}
 
-        for origem in self.estados:
-            alcancaveis = self.pegar_alcancaveis(origem)
+        for (origem, simbolo), destinos in self.mapa_transicoes.items():
+            if simbolo not in self.alfabeto:
+                continue
 
-            if any(estado in self.estados_finais for estado in alcancaveis):
-                resultado.append(origem)
-        
-        return frozenset(resultado)
+            for destino in destinos:
+                anteriores.setdefault(destino, set()).add(origem)
+
+        produtivos: Set[Estado] = set(self.estados_finais)
+        restantes: Deque[Estado] = deque(produtivos)
+
+        while restantes:
+            estado = restantes.popleft()
+            novos = anteriores.get(estado, _VAZIO) - produtivos
+
+            restantes.extend(novos)
+            produtivos |= novos
+
+        return frozenset(produtivos)
 
     def descartar_estados_inuteis(self) -> "AutomatoFinito":
         """
@@ -188,7 +365,7 @@ class AutomatoFinito:
         inalcancaveis = self.estados - alcancaveis
         mortos = self.estados - produtivos
 
-        descartados = set([*inalcancaveis, *mortos])
+        descartados = inalcancaveis | mortos
 
         transicoes: List[Transicao] = [
             transicao for transicao in self.transicoes()
@@ -202,61 +379,103 @@ class AutomatoFinito:
         )
 
     def calcular_estados_equivalentes(self) -> FrozenSet[FrozenSet[Estado]]:
-        """Calcula o conjunto de classes de equivalência do autômato."""
+        """
+        Calcula o conjunto de classes de equivalência do autômato
+        utilizando o algoritmo de Hopcroft.
+        """
 
-        # partição inicial de estados não-finais e finais
-        classes = frozenset([
-            self.estados - self.estados_finais,
-            self.estados_finais
-        ])
-        visitados = set()
+        # estado morto implícito, destino das transições inexistentes
+        # (None, como retornado por transicao_deterministica)
+        morto = None
 
-        while True:
-            mapa_classes: Dict[Tuple, Set[Estado]] = {}
+        # mapa inverso de transições: (destino, símbolo) -> origens
+        inversas: Dict[Tuple[Union[Estado, None], str], Set[Union[Estado, None]]] = {}
 
-            for estado in self.estados:
-                # lista de índices das classes que este estado vai
-                # para cada símbolo do alfabeto.
-                classes_destino: List[int] = []
+        for estado_origem in self.estados:
+            for simbolo in self.alfabeto:
+                estado_destino = self.transicao_deterministica(estado_origem, simbolo)
 
-                for simbolo in self.alfabeto:
-                    destinos = self.transicao(estado, simbolo)
+                inversas.setdefault((estado_destino, simbolo), set()).add(estado_origem)
 
-                    # -1 se o estado não possui transição por este símbolo
-                    if not destinos:
-                        classes_destino.append(-1)
-                        continue
-                    
-                    destino, *_ = destinos
-
-                    # procura a classe que possui este estado
-                    for i, classe in enumerate(classes):
-                        if destino not in classe:
-                            continue
-                        classes_destino.append(i)
-                        break
-                
-                final = estado in self.estados_finais
-                chave = (*classes_destino, final)
-
-                # adiciona este estado a sua classe equivalente
-                classe: Set[Estado] = mapa_classes.setdefault(chave, set())
-                classe.add(estado)
-            
-            classes = frozenset(frozenset(classe) for classe in mapa_classes.values())
-
-            if classes in visitados:
-                return classes
-            visitados.add(classes)
+        for simbolo in self.alfabeto:
+            inversas.setdefault((morto, simbolo), set()).add(morto)
+
+        # partição inicial de estados finais e não-finais
+        finais: Set[Union[Estado, None]] = set(self.estados_finais)
+        nao_finais: Set[Union[Estado, None]] = set(self.estados - self.estados_finais)
+        nao_finais.add(morto)
+
+        classes: List[Set[Union[Estado, None]]] = [finais, nao_finais] if finais else [nao_finais]
+        classe_de: Dict[Union[Estado, None], int] = {
+            estado: i for i, classe in enumerate(classes) for estado in classe
+        }
+
+        # pares (classe, símbolo) que ainda podem refinar a partição
+        menor_inicial = min(range(len(classes)), key=lambda i: len(classes[i]))
+        pendentes: Set[Tuple[int, str]] = set(
+            (menor_inicial, simbolo) for simbolo in self.alfabeto
+        ) if len(classes) > 1 else set()
+
+        while pendentes:
+            indice, simbolo = pendentes.pop()
+
+            # estados que vão para a classe escolhida lendo o símbolo
+            origens: Set[Union[Estado, None]] = set()
+            for destino in classes[indice]:
+                origens.update(inversas.get((destino, simbolo), ()))
+
+            # agrupa as origens pela classe a qual pertencem
+            atingidas: Dict[int, Set[Union[Estado, None]]] = {}
+            for estado in origens:
+                atingidas.setdefault(classe_de[estado], set()).add(estado)
+
+            for i, interseccao in atingidas.items():
+                classe = classes[i]
+
+                if len(interseccao) == len(classe):
+                    continue
+
+                diferenca = classe - interseccao
+
+                # a maior parte mantém o índice da classe original
+                maior, menor = (interseccao, diferenca) \
+                    if len(interseccao) >= len(diferenca) else (diferenca, interseccao)
+
+                j = len(classes)
+                classes[i] = maior
+                classes.append(menor)
+
+                for estado in menor:
+                    classe_de[estado] = j
+
+                for s in self.alfabeto:
+                    pendentes.add((j, s))
+
+        # o estado morto é removido das classes retornadas
+        equivalentes: Set[FrozenSet[Estado]] = set()
+        for classe in classes:
+            estados = frozenset(estado for estado in classe if estado is not morto)
+            if estados:
+                equivalentes.add(estados)
+
+        return frozenset(equivalentes)
     
     def minimizar(self) -> "AutomatoFinito":
         """Retorna o autômato finito determinístico equivalente mínimo."""
 
+        # determiniza apenas se o autômato ainda não for determinístico
+        automato = self if self.mapa_transicoes_det is not None else self.determinizar()
+
         # descarta estados mortos e inalcançáveis
-        automato = self.descartar_estados_inuteis()
+        automato = automato.descartar_estados_inuteis()
 
         # calcula as classes de equivalencia
         estados_equivalentes = automato.calcular_estados_equivalentes()
+
+        # se nenhum estado é equivalente a outro, o autômato já é mínimo
+        if len(estados_equivalentes) == len(automato.estados):
+            return automato
+
         # une os estados equivalentes, considerando apenas o nome do
         # primeiro estado em ordem lexicográfica crescente
         estados_unidos = [sorted(classe)[0] for classe in estados_equivalentes]
@@ -270,7 +489,7 @@ class AutomatoFinito:
         
         # calcula as novas transições, estado inicial e estados finais
         transicoes: List[Transicao] = [
-            [mapa[origem], simbolo, mapa[destino]]
+            (mapa[origem], simbolo, mapa[destino])
             for origem, simbolo, destino in automato.transicoes()
         ]
         inicial = mapa[automato.estado_inicial]
@@ -286,16 +505,18 @@ class AutomatoFinito:
         finais = "{" + ",".join(sorted(self.estados_finais)) + "}"
         alfabeto = "{" + ",".join(sorted(self.alfabeto)) + "}"
 
-        t = self.transicoes()
-        t = sorted(t, key=lambda v: v[1])
-        t = sorted(t, key=lambda v: v[0][1:-1] if v[0].startswith("{") else v[0])
+        # ordena pelo estado de origem, sem as chaves de conjunto, e depois pelo símbolo
+        t = sorted(
+            self.transicoes(),
+            key=lambda v: (v[0][1:-1] if v[0].startswith("{") else v[0], v[1])
+        )
 
-        transicoes = ";".join(",".join(transicao) for transicao in t)
+        transicoes = ";".join(map(",".join, t))
 
         return f"{num_estados};{inicial};{finais};{alfabeto};{transicoes}"
     
     @property
-    def codigo_fonte(self):
+    def codigo_fonte(self) -> str:
         msg = ""
         indent = "    "
 
@@ -324,12 +545,20 @@ def parse(entrada: str) -> AutomatoFinito:
     """
 
     # remove todos os espaços em branco
-    entrada = re.sub(r"\s+", "", entrada)
+    entrada = entrada.translate(_ESPACOS)
 
     _, inicial, finais_str, alfabeto_str, *transicoes_str = entrada.split(";")
 
     finais = set(finais_str[1:-1].split(","))
     alfabeto = set(alfabeto_str[1:-1].split(","))
-    transicoes = set(tuple(t.split(",")) for t in transicoes_str)
+    transicoes: List[Transicao] = []
+
+    for transicao_str in transicoes_str:
+        campos = transicao_str.split(",")
+        if len(campos) != 3:
+            raise ValueError(f"Transição inválida: {transicao_str}")
+
+        origem, simbolo, destino = campos
+        transicoes.append((origem, simbolo, destino))
 
     return AutomatoFinito(inicial, finais, alfabeto, transicoes)
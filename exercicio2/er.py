@@ -1,69 +1,87 @@
-from dataclasses import dataclass, field, replace
-from typing import Any, FrozenSet, Set, Dict, List, Tuple, Union
+from collections import deque
+from dataclasses import dataclass, field
+from functools import lru_cache, reduce
+from typing import Any, Callable, Dict, Final, Iterator, List, Set, Tuple, Union
+
+
+def iter_bits(mask: int) -> Iterator[int]:
+    while mask:
+        bit = mask & -mask
+        yield bit.bit_length() - 1
+        mask ^= bit
 
 
-@dataclass(frozen=True)
 class RegexNode:
-    nullable: bool = field(default=None, repr=True)
-    firstpos: FrozenSet[int] = field(default_factory=frozenset, repr=True)
-    lastpos: FrozenSet[int] = field(default_factory=frozenset, repr=True)
+    __slots__ = ("nullable", "firstpos", "lastpos")
+
+    def __init__(self, nullable: Union[bool, None] = None):
+        self.nullable = nullable
+        self.firstpos = 0
+        self.lastpos = 0
+
+    def __repr__(self) -> str:
+        fields = ", ".join(
+            f"{name}={getattr(self, name)!r}"
+            for cls in reversed(type(self).__mro__)
+            for name in getattr(cls, "__slots__", ())
+        )
+        return f"{type(self).__name__}({fields})"
 
-@dataclass(frozen=True)
 class LeafNode(RegexNode):
-    value: str = ""
+    __slots__ = ("value",)
 
-EMPTY = LeafNode(value="")
+    def __init__(self, value: str = ""):
+        super().__init__(nullable=not value)
+        self.value = value
+
+EMPTY: Final = LeafNode(value="")
 
-@dataclass(frozen=True)
 class CatNode(RegexNode):
-    left: RegexNode = EMPTY
-    right: RegexNode = EMPTY
+    __slots__ = ("left", "right")
+
+    def __init__(self, left: RegexNode = EMPTY, right: RegexNode = EMPTY):
+        super().__init__()
+        self.left = left
+        self.right = right
 
-@dataclass(frozen=True)
 class OrNode(RegexNode):
-    left: RegexNode = EMPTY
-    right: RegexNode = EMPTY
+    __slots__ = ("left", "right")
+
+    def __init__(self, left: RegexNode = EMPTY, right: RegexNode = EMPTY):
+        super().__init__()
+        self.left = left
+        self.right = right
 
-@dataclass(frozen=True)
 class StarNode(RegexNode):
-    child: RegexNode = EMPTY
+    __slots__ = ("child",)
 
+    def __init__(self, child: RegexNode = EMPTY):
+        super().__init__()
+        self.child = child
 
-@dataclass
-class Reader:
-    value: str
-    pos: str = 0
+class NAryCatNode(RegexNode):
+    __slots__ = ("children",)
+
+    def __init__(self, children: Tuple[RegexNode, ...] = ()):
+        super().__init__()
+        self.children = children
 
-    @property
-    def end(self):
-        return self.pos >= len(self.value)
-    
-    def advance(self):
-        if self.end:
-            return
-        
-        self.pos += 1
 
-    def read(self) -> Union[str, None]:
-        ch = self.peek()
-        self.advance()
+_LEAF_CACHE: Final[Dict[str, LeafNode]] = {}
 
-        return ch
+def get_leaf(value: str) -> LeafNode:
+    leaf = _LEAF_CACHE.get(value)
 
-    def peek(self) -> Union[str, None]:
-        if self.end:
-            return None
+    if leaf is None:
+        leaf = _LEAF_CACHE[value] = LeafNode(value=value)
 
-        ch = self.value[self.pos]
+    return leaf
 
-        if ch in ("\n", " "):
-            self.advance()
-            return self.peek()
-        
-        return ch
 
+_OPERATORS: Final = frozenset("()|*&")
+_WHITESPACE: Final = str.maketrans("", "", " \n")
 
-def parse_regex(value: str):
+def parse_regex(value: str) -> RegexNode:
     """
     
     Gramática:
@@ -75,211 +93,278 @@ def parse_regex(value: str):
     ```
     """
 
-    return parse_alternative(Reader(value))
-
-def parse_alternative(reader: Reader):
-    node = parse_sequence(reader)
-
-    while reader.peek() == "|":
-        reader.advance()
-
-        right = parse_sequence(reader)
-        node = OrNode(left=node, right=right)
-
-    return node
-
-def parse_sequence(reader: Reader):
+    # alternatives and terms of each enclosing group, one entry per open '('
+    groups: List[Tuple[List[RegexNode], List[RegexNode]]] = []
+    alternatives: List[RegexNode] = []
     terms: List[RegexNode] = []
 
-    while not reader.end and reader.peek() not in (")", "|"):
-        terms.append(parse_term(reader))
-    
+    for ch in value.translate(_WHITESPACE):
+        # most characters are symbols, so they are told apart with one lookup
+        if ch not in _OPERATORS:
+            terms.append(get_leaf(ch))
+        elif ch == "(":
+            groups.append((alternatives, terms))
+            alternatives, terms = [], []
+        elif ch == ")":
+            if not groups:
+                break
+
+            node = make_alternative(alternatives, terms)
+            alternatives, terms = groups.pop()
+            terms.append(node)
+        elif ch == "|":
+            alternatives.append(make_sequence(terms))
+            terms = []
+        elif ch == "*" and terms:
+            terms[-1] = StarNode(terms[-1])
+        elif ch == "&":
+            terms.append(EMPTY)
+        else:
+            # '*' with nothing to repeat is a symbol
+            terms.append(get_leaf(ch))
+
+    # groups left open are closed at the end of the input
+    while groups:
+        node = make_alternative(alternatives, terms)
+        alternatives, terms = groups.pop()
+        terms.append(node)
+
+    return make_alternative(alternatives, terms)
+
+def make_sequence(terms: List[RegexNode]) -> RegexNode:
     if not terms:
-        return LeafNode(value="")
-    
-    if len(terms) == 1:
-        return terms[0]
-    
-    node, *terms = terms
-    for other in terms:
-        node = CatNode(left=node, right=other)
-    
-    return node
+        return EMPTY
 
-def parse_term(reader: Reader):
-    node = parse_factor(reader)
-
-    while reader.peek() == "*":
-        reader.advance()
-        node = StarNode(child=node)
-    
-    return node
-
-def parse_factor(reader: Reader):
-    if reader.peek() == "(":
-        reader.advance()
-        value = parse_alternative(reader)
-        reader.advance()
-
-        return value
-    
-    value = reader.read()
+    if len(terms) > 2:
+        return NAryCatNode(tuple(terms))
 
-    if value == "&":
-        return LeafNode(value="")
+    return reduce(CatNode, terms)
 
-    return LeafNode(value=value if value is not None else "")
+def make_alternative(alternatives: List[RegexNode], terms: List[RegexNode]) -> RegexNode:
+    return reduce(OrNode, (*alternatives, make_sequence(terms)))
 
 
 @dataclass
 class AnnotationAccumulator:
     pos: int = 0
-    followpos: Dict[int, Set[int]] = field(default_factory=dict)
+    # followpos and symbol of every position, in lists indexed by position
+    followpos: List[int] = field(default_factory=lambda: [0])
+    symbols: List[str] = field(default_factory=lambda: [""])
+    # annotated subtrees without positions, by id of the original node
+    position_free: Dict[int, RegexNode] = field(default_factory=dict)
 
-def annotate_tree(root: RegexNode) -> Tuple[RegexNode, Dict[int, Set[int]]]:
+def annotate_tree(root: RegexNode) -> Tuple[RegexNode, List[int], List[str]]:
     acc = AnnotationAccumulator()
-    annotated_tree = visit_node(root, acc)
 
-    return annotated_tree, acc.followpos
+    # post-order walk. a node is pushed with arity -1 to be expanded, then again
+    # with its number of children, which by then are on top of annotated
+    annotated: List[RegexNode] = []
+    stack: List[Tuple[RegexNode, int]] = [(root, -1)]
+
+    while stack:
+        node, arity = stack.pop()
+
+        if arity < 0:
+            # a subtree without positions annotates the same on every occurrence,
+            # so shared ones are visited once. the others are walked again on
+            # every occurrence, each getting its own positions and nodes
+            shared = acc.position_free.get(id(node))
+            if shared is not None:
+                annotated.append(shared)
+                continue
 
-def visit_node(node: RegexNode, acc: AnnotationAccumulator) -> RegexNode:
-    if isinstance(node, LeafNode):
-        return visit_leaf(node, acc)
-    
-    if isinstance(node, StarNode):
-        return visit_star(node, acc)
+            children = _CHILDREN[type(node)](node)
+            stack.append((node, len(children)))
+            stack.extend((child, -1) for child in reversed(children))
+            continue
+
+        annotated_children = annotated[len(annotated) - arity:]
+        del annotated[len(annotated) - arity:]
 
-    if isinstance(node, OrNode):
-        return visit_or(node, acc)
+        result = _VISITORS[type(node)](node, annotated_children, acc)
+        if not result.firstpos:
+            acc.position_free[id(node)] = result
 
-    if isinstance(node, CatNode):
-        return visit_cat(node, acc)
+        annotated.append(result)
 
-def visit_leaf(node: LeafNode, acc: AnnotationAccumulator):
+    return annotated[0], acc.followpos, acc.symbols
+
+def visit_leaf(node: LeafNode, children: List[RegexNode], acc: AnnotationAccumulator) -> LeafNode:
     if not node.value:
-        return replace(
-            node, nullable=True, firstpos=frozenset(), lastpos=frozenset()
-        )
+        return node
 
     acc.pos += 1
-    pos = frozenset([acc.pos])
-
-    return replace(node, nullable=False, firstpos=pos, lastpos=pos)
+    acc.followpos.append(0)
+    acc.symbols.append(node.value)
+
+    # leaves may be shared, so each occurrence gets its own annotated copy
+    leaf = LeafNode(value=node.value)
+    leaf.firstpos = leaf.lastpos = 1 << acc.pos
+
+    return leaf
+
+def visit_star(node: StarNode, children: List[RegexNode], acc: AnnotationAccumulator) -> StarNode:
+    child, = children
+
+    for i in iter_bits(child.lastpos):
+        acc.followpos[i] |= child.firstpos
+
+    # the input node may be shared, so the annotation goes into a new one
+    star = StarNode(child=child)
+    star.nullable = True
+    star.firstpos = child.firstpos
+    star.lastpos = child.lastpos
+
+    return star
+
+def visit_or(node: OrNode, children: List[RegexNode], acc: AnnotationAccumulator) -> OrNode:
+    left, right = children
+
+    union = OrNode(left=left, right=right)
+    union.nullable = left.nullable or right.nullable
+    union.firstpos = left.firstpos | right.firstpos
+    union.lastpos = left.lastpos | right.lastpos
+
+    return union
+
+def visit_cat(node: CatNode, children: List[RegexNode], acc: AnnotationAccumulator) -> CatNode:
+    left, right = children
+
+    for i in iter_bits(left.lastpos):
+        acc.followpos[i] |= right.firstpos
+
+    cat = CatNode(left=left, right=right)
+    cat.nullable = left.nullable and right.nullable
+    cat.firstpos = left.firstpos | right.firstpos if left.nullable else left.firstpos
+    cat.lastpos = left.lastpos | right.lastpos if right.nullable else right.lastpos
+
+    return cat
+
+def visit_nary_cat(node: NAryCatNode, children: List[RegexNode], acc: AnnotationAccumulator) -> NAryCatNode:
+    # walking backwards, following holds the firstpos of the children after
+    # the current one, up to the first non nullable of them
+    following = 0
+    for child in reversed(children):
+        for i in iter_bits(child.lastpos):
+            acc.followpos[i] |= following
+
+        following = child.firstpos | following if child.nullable else child.firstpos
+
+    preceding = 0
+    for child in children:
+        preceding = child.lastpos | preceding if child.nullable else child.lastpos
+
+    cat = NAryCatNode(children=tuple(children))
+    cat.nullable = all(child.nullable for child in children)
+    cat.firstpos = following
+    cat.lastpos = preceding
+
+    return cat
+
+_CHILDREN: Final[Dict[type, Callable[[Any], Tuple[RegexNode, ...]]]] = {
+    LeafNode: lambda node: (),
+    StarNode: lambda node: (node.child,),
+    OrNode: lambda node: (node.left, node.right),
+    CatNode: lambda node: (node.left, node.right),
+    NAryCatNode: lambda node: node.children,
+}
+
+_VISITORS: Final[Dict[type, Callable[[Any, List[RegexNode], AnnotationAccumulator], RegexNode]]] = {
+    LeafNode: visit_leaf,
+    StarNode: visit_star,
+    OrNode: visit_or,
+    CatNode: visit_cat,
+    NAryCatNode: visit_nary_cat,
+}
+
+def build_dfa(
+    initial: int, symbol_of_pos: List[str], follow_of_pos: List[int]
+) -> Tuple[List[int], List[str], List[List[int]]]:
+    # symbols are numbered in sorted order. the transition table has a row per
+    # state and a column per symbol ordinal, holding the destination id or -1
+    alphabet = sorted(set(symbol_of_pos))
+    ordinals = {symbol: n for n, symbol in enumerate(alphabet)}
+    ordinal_of_pos = [ordinals[symbol] for symbol in symbol_of_pos]
+
+    # every position set is hashed once, when it gets a dense state id.
+    # states holds the sets by id
+    states = [initial]
+    ids = {initial: 0}
+    table = [[-1] * len(alphabet)]
 
-def visit_star(node: StarNode, acc: AnnotationAccumulator):
-    child = visit_node(node.child, acc)
+    # followpos merged per symbol ordinal, reset after every state through
+    # the list of ordinals touched by it
+    merged = [0] * len(alphabet)
+    touched: List[int] = []
 
-    firstpos = child.firstpos
-    lastpos = child.lastpos
+    remaining = deque([0])
 
-    for i in lastpos:
-        positions = acc.followpos.setdefault(i, set())
-        positions.update(firstpos)
+    while remaining:
+        state_id = remaining.popleft()
+        row = table[state_id]
 
-    return replace(
-        node,
-        child=child,
-        nullable=True,
-        firstpos=firstpos,
-        lastpos=lastpos
-    )
+        for i in iter_bits(states[state_id]):
+            follow = follow_of_pos[i]
+            if not follow:
+                continue
 
-def visit_or(node: OrNode, acc: AnnotationAccumulator):
-    left = visit_node(node.left, acc)
-    right = visit_node(node.right, acc)
-
-    return replace(
-        node,
-        left=left,
-        right=right,
-        nullable=left.nullable or right.nullable,
-        firstpos=left.firstpos | right.firstpos,
-        lastpos=left.lastpos | right.lastpos,
-    )
+            n = ordinal_of_pos[i]
+            if not merged[n]:
+                touched.append(n)
+            merged[n] |= follow
 
-def visit_cat( node: CatNode, acc: AnnotationAccumulator):
-    left = visit_node(node.left, acc)
-    right = visit_node(node.right, acc)
-
-    for i in left.lastpos:
-        positions = acc.followpos.setdefault(i, set())
-        positions.update(right.firstpos)
-
-    return replace(
-        node,
-        left=left,
-        right=right,
-        nullable=left.nullable and right.nullable,
-        firstpos=left.firstpos | right.firstpos if left.nullable else left.firstpos,
-        lastpos=left.lastpos | right.lastpos if right.nullable else right.lastpos,
-    )
+        # new states are numbered in symbol order
+        touched.sort()
 
+        for n in touched:
+            dest = merged[n]
+            merged[n] = 0
 
-def get_leafs(node: RegexNode) -> Tuple[LeafNode, ...]:
-    if isinstance(node, LeafNode):
-        return (node,) if node.value else ()
+            dest_id = ids.get(dest)
 
-    if isinstance(node, (OrNode, CatNode)):
-        return get_leafs(node.left) + get_leafs(node.right)
+            if dest_id is None:
+                dest_id = ids[dest] = len(states)
+                states.append(dest)
+                table.append([-1] * len(alphabet))
+                remaining.append(dest_id)
 
-    if isinstance(node, StarNode):
-        return get_leafs(node.child)
-    
-    return ()
+            row[n] = dest_id
 
-def generate_automaton(
-    annotated_tree: RegexNode, followpos: Dict[int, Set[int]]
-):
-    leafs = get_leafs(annotated_tree)
-    symbol_map = {
-        i: node.value
-        for node in leafs
-        for i in node.firstpos
-    }
-
-    initial = annotated_tree.firstpos
-    transitions = []
+        touched.clear()
 
-    states = [initial]
-    remaining = [initial]
+    return states, alphabet, table
 
-    while remaining:
-        state = remaining.pop(0)
+DfaTuple = Tuple[List[str], Set[str], str, List[str], List[Tuple[str, str, str]]]
 
-        destinations: Dict[str, FrozenSet[int]] = {}
-        for i in sorted(state, key=lambda s: symbol_map[s]):
-            symbol = symbol_map[i]
-            dest = destinations.get(symbol, frozenset()) | followpos.get(i, frozenset())
+def generate_automaton(
+    annotated_tree: RegexNode, followpos: List[int], symbols: List[str]
+) -> DfaTuple:
+    states, alphabet, table = build_dfa(annotated_tree.firstpos, symbols, followpos)
 
-            if not dest:
-                continue
-            destinations[symbol] = dest
-        
-        state_transitions = [
-            (state, symbol, dest) for symbol, dest in destinations.items()
-        ]
-        transitions.extend(state_transitions)
-        remaining.extend(s for s in destinations.values() if s not in states)
-        states.extend(s for s in destinations.values() if s not in states)
-    
-    final_i, *_ = leafs[-1].lastpos
-    finals = [state for state in states if final_i in state]
+    names = [
+        "{" + ",".join(str(n) for n in iter_bits(state)) + "}" for state in states
+    ]
 
-    alphabet = set(symbol for _, symbol, _ in transitions)
+    # the end marker is the last position
+    final = 1 << (len(symbols) - 1)
+    finals = [names[i] for i, state in enumerate(states) if state & final]
 
-    format = {
-        state: "{" + ",".join(str(n) for n in sorted(state)) + "}" for state in states
-    }
+    transitions = [
+        (names[origin], alphabet[n], names[dest])
+        for origin, row in enumerate(table)
+        for n, dest in enumerate(row)
+        if dest >= 0
+    ]
 
     return (
-        [format[s] for s in states],
-        alphabet,
-        format[initial],
-        [format[s] for s in finals],
-        [(format[origin], symbol, format[dest]) for origin, symbol, dest in transitions]
+        names,
+        set(symbol for _, symbol, _ in transitions),
+        names[0],
+        finals,
+        transitions,
     )
 
-def serialize(dfa_tuple: Any):
+def serialize(dfa_tuple: DfaTuple) -> str:
     states, alphabet, initial, finals, transitions = dfa_tuple
 
     num_states = len(states)
@@ -290,13 +375,24 @@ def serialize(dfa_tuple: Any):
     return f"{num_states};{initial};{finals_str};{alfabeto};{transitions_str}"
 
 
-def convert_regex(value: Union[str, RegexNode]):
-    node = parse_regex(value) if isinstance(value, str) else value
-    node = CatNode(left=node, right=LeafNode(value="#"))
+def convert_regex(value: Union[str, RegexNode]) -> str:
+    if isinstance(value, str):
+        return convert_source(value)
+
+    return convert_tree(value)
+
+# the result is a string, so it is shared safely. trees are not cached since
+# nodes are mutable and hash by id, so a key could match a changed or new tree
+@lru_cache(maxsize=256)
+def convert_source(value: str) -> str:
+    return convert_tree(parse_regex(value))
+
+def convert_tree(node: RegexNode) -> str:
+    node = CatNode(left=node, right=get_leaf("#"))
 
-    annotated_tree, followpos = annotate_tree(node)
+    annotated_tree, followpos, symbols = annotate_tree(node)
 
-    dfa_tuple = generate_automaton(annotated_tree, followpos)
+    dfa_tuple = generate_automaton(annotated_tree, followpos, symbols)
 
     return serialize(dfa_tuple)
 
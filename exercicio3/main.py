@@ -16,93 +16,216 @@ S = S or A; S = A; A = A and B; A = B; B = not B; S = (S); S = true; S = false;
 """
 
 from dataclasses import dataclass
-import re
-from typing import Any, Dict, FrozenSet, Iterable, Set, Tuple
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
 
 
+# sets of terminals are int masks with a bit per terminal. '&' and the end
+# marker '$' take the first two bits
+EPSILON = 1 << 0
+END = 1 << 1
+
 def is_terminal(symbol: str) -> bool:
     return not symbol.isupper()
 
 @dataclass(init=False)
 class Grammar:
-    rule_map: Dict[str, Set[str]]
+    rule_map: Dict[str, List[str]]
     initial: str
 
     def __init__(self, rules: Iterable[Tuple[str, str]]):
         self.rule_map = {}
         self.initial, _ = rules[0]
+        self._first_cache: Optional[Dict[str, int]] = None
+        self._follow_cache: Optional[Dict[str, int]] = None
+        self._sequence_first_cache: Dict[str, FrozenSet[str]] = {}
+        self._follow_set_cache: Dict[str, FrozenSet[str]] = {}
+        self._suffix_first_cache: Optional[Dict[Tuple[str, str], List[int]]] = None
         
+        # bodies keep their input order, without repeats
+        seen: Set[Tuple[str, str]] = set()
+
         for head, body in rules:
-            sequences = self.rule_map.setdefault(head, set())
-            sequences.add(body)
+            sequences = self.rule_map.setdefault(head, [])
 
-    @property
-    def nonterminals(self) -> Tuple[str]:
-        symbols = []
-        
-        symbols.extend(head for head in self.rule_map.keys() if head not in symbols)
+            if (head, body) not in seen:
+                seen.add((head, body))
+                sequences.append(body)
+
+        # the rules and symbols of the grammar never change, so they are
+        # collected once
+        self._bodies = {head: tuple(sequences) for head, sequences in self.rule_map.items()}
+        self._rules = tuple(
+            (head, sequence)
+            for head, sequences in self._bodies.items()
+            for sequence in sequences
+        )
+
+        # dicts keep insertion order, so symbols are listed as they first appear
+        nonterminals = dict.fromkeys(self.rule_map)
+        nonterminals.update(dict.fromkeys(
+            s for _, sequence in self._rules for s in sequence if not is_terminal(s)
+        ))
 
-        for sequences in self.rule_map.values():
-            for sequence in sequences:
-                for s in sequence:
-                    if not is_terminal(s) and s not in symbols:
-                        symbols.append(s)
+        self._nonterminals = tuple(nonterminals)
+        self._nonterminal_set = frozenset(s for s in nonterminals if not is_terminal(s))
 
-        return tuple(symbols)
+        self._terminal_masks = {"&": EPSILON, "$": END}
+
+        for _, sequence in self._rules:
+            for s in sequence:
+                if is_terminal(s) and s not in self._terminal_masks:
+                    self._terminal_masks[s] = 1 << len(self._terminal_masks)
+
+    @property
+    def nonterminals(self) -> Tuple[str, ...]:
+        return self._nonterminals
 
     @property
-    def rules(self) -> Iterable[Tuple[str, str]]:
-        for head, body in self.rule_map.items():
-            for sequence in body:
-                yield (head, sequence)
+    def rules(self) -> Tuple[Tuple[str, str], ...]:
+        return self._rules
 
     def get_body(self, non_terminal: str) -> Tuple[str, ...]:
-        return tuple(self.rule_map.get(non_terminal, ()))
+        return self._bodies.get(non_terminal, ())
     
-    def get_first(self, sequence: str, search_stack: Tuple[str, ...] = ()) -> FrozenSet[str]:
-        first_set = set()
+    def get_first(self, sequence: str) -> FrozenSet[str]:
+        first_set = self._sequence_first_cache.get(sequence)
+
+        if first_set is None:
+            first_set = self._terminals_of(self._first_mask(sequence))
+            self._sequence_first_cache[sequence] = first_set
+
+        return first_set
+
+    def _first_mask(self, sequence: str) -> int:
+        return self._first_of_sequence(sequence, self._get_firsts())
+
+    def _get_firsts(self) -> Dict[str, int]:
+        if self._first_cache is None:
+            self._first_cache = self._compute_firsts()
+
+        return self._first_cache
+
+    def _compute_firsts(self) -> Dict[str, int]:
+        first = {symbol: 0 for symbol in self.nonterminals}
+
+        # the first set of every head grows with the first of its bodies until
+        # no rule adds anything
+        changed = True
+        while changed:
+            changed = False
+
+            for head, body in self.rules:
+                head_first = first[head] | self._first_of_sequence(body, first)
+
+                if head_first != first[head]:
+                    first[head] = head_first
+                    changed = True
+
+        return first
+
+    def _first_of_sequence(self, sequence: str, first: Dict[str, int]) -> int:
+        first_mask = 0
 
         for symbol in sequence:
-            if is_terminal(symbol):
-                symbol_first_set = {symbol,}
-            else:
-                bodies = self.get_body(symbol)
-                first_of_bodies = [
-                    self.get_first(body, (body[0], *search_stack))
-                    for body in bodies if body[0] not in search_stack
-                ]
-                symbol_first_set = set(s for first in first_of_bodies for s in first)
-
-            first_set.update(symbol_first_set)
-
-            if "&" not in symbol_first_set:
-                break
+            symbol_mask = first[symbol] if symbol in self._nonterminal_set else self._terminal_masks[symbol]
+
+            # the first symbol that does not derive '&' ends the sequence, and
+            # '&' only belongs to it when every symbol derives it
+            if not symbol_mask & EPSILON:
+                return first_mask & ~EPSILON | symbol_mask
+
+            first_mask |= symbol_mask
     
-        return frozenset(first_set)
+        return first_mask
 
-    def get_follow(self, non_terminal: str, search_stack: Tuple[str, ...] = ()) -> Tuple[str, ...]:
-        follow_set = set()
+    def _get_suffix_firsts(self) -> Dict[Tuple[str, str], List[int]]:
+        if self._suffix_first_cache is None:
+            self._suffix_first_cache = self._compute_suffix_firsts()
 
-        if non_terminal == self.initial:
-            follow_set.add("$")
-        
-        for head, sequence in self.rules:
-            for i, symbol in enumerate(sequence):
-                if symbol == non_terminal:
-                    rightside = sequence[i+1:]
-                    rightside_first = self.get_first(rightside)
-
-                    if rightside:
-                        follow_set.update(rightside_first)
-
-                    if not rightside or "&" in rightside_first:
-                        if head not in search_stack:
-                            follow_set.update(self.get_follow(head, (*search_stack, head)))
-        
-        return follow_set - {"&"}
+        return self._suffix_first_cache
+
+    def _compute_suffix_firsts(self) -> Dict[Tuple[str, str], List[int]]:
+        first = self._get_firsts()
+        suffix_firsts: Dict[Tuple[str, str], List[int]] = {}
+
+        for head, body in self.rules:
+            # first of body[i:] at index i, walking the body backwards. the empty
+            # rest of a body derives '&'
+            suffixes = [0] * len(body) + [EPSILON if body else 0]
+
+            for i in range(len(body) - 1, -1, -1):
+                symbol = body[i]
+                symbol_mask = first[symbol] if symbol in self._nonterminal_set else self._terminal_masks[symbol]
+
+                if symbol_mask & EPSILON:
+                    suffixes[i] = symbol_mask & ~EPSILON | suffixes[i + 1]
+                else:
+                    suffixes[i] = symbol_mask
+
+            suffix_firsts[(head, body)] = suffixes
+
+        return suffix_firsts
+
+    def _terminals_of(self, mask: int) -> FrozenSet[str]:
+        return frozenset(
+            terminal for terminal, terminal_mask in self._terminal_masks.items()
+            if mask & terminal_mask
+        )
+
+    def get_follow(self, non_terminal: str) -> FrozenSet[str]:
+        follow_set = self._follow_set_cache.get(non_terminal)
+
+        if follow_set is None:
+            follow_set = self._terminals_of(self._get_follows().get(non_terminal, 0))
+            self._follow_set_cache[non_terminal] = follow_set
+
+        return follow_set
+
+    def _get_follows(self) -> Dict[str, int]:
+        if self._follow_cache is None:
+            self._follow_cache = self._compute_follows()
+
+        return self._follow_cache
+
+    def _compute_follows(self) -> Dict[str, int]:
+        suffix_firsts = self._get_suffix_firsts()
+
+        follow = {symbol: 0 for symbol in self.nonterminals}
+        follow[self.initial] = END
+
+        # heads whose follow flows into a nonterminal, because the rest of the
+        # body after it derives '&'
+        inherited: List[Tuple[str, str]] = []
+
+        for head, body in self.rules:
+            suffixes = suffix_firsts[(head, body)]
+
+            for i, symbol in enumerate(body):
+                if symbol not in self._nonterminal_set:
+                    continue
+
+                rightside_first = suffixes[i + 1]
+                follow[symbol] |= rightside_first & ~EPSILON
+
+                if rightside_first & EPSILON:
+                    inherited.append((head, symbol))
+
+        changed = True
+        while changed:
+            changed = False
+
+            for head, symbol in inherited:
+                symbol_follow = follow[symbol] | follow[head]
+
+                if symbol_follow != follow[symbol]:
+                    follow[symbol] = symbol_follow
+                    changed = True
+
+        return follow
 
 def parse_grammar(input: str):
-    input = re.sub("\s", "", input)
+    # str.split drops every whitespace character, unicode ones included
+    input = "".join(input.split())
 
     rules_str = input.split(";")
     rules = [tuple(r.split("=")) for r in rules_str if r]
@@ -110,11 +233,17 @@ def parse_grammar(input: str):
     return Grammar(rules)
 
 
-def format_set(value: Set[Any]) -> str:
-    alpha = sorted(el for el in value if str(el).isalpha())
+def format_set(value: Iterable[str]) -> str:
+    # letters come first, then the other symbols, each group sorted
+    alpha: List[str] = []
+    other: List[str] = []
+
+    for el in value:
+        (alpha if el.isalpha() else other).append(el)
 
-    ordered = alpha + list(value - set(alpha))
-    return "{" + ", ".join(str(el) for el in ordered) + "}"
+    alpha.sort()
+    other.sort()
+    return "{" + ", ".join(alpha + other) + "}"
 
 if __name__ == "__main__":
     grammar_str = input()
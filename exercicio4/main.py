@@ -1,7 +1,7 @@
 
 from dataclasses import dataclass
-import re
-from typing import Any, Dict, FrozenSet, Iterable, List, Set, Tuple
+from operator import itemgetter
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
 
 MSG_GRAMATICA_RECURSIVA = r"""
                                                 -----
@@ -32,6 +32,11 @@ class GrammarException(Exception):
     ...
 
 
+# sets of terminals are int masks with a bit per terminal. '&' and the end
+# marker '$' take the first two bits
+EPSILON = 1 << 0
+END = 1 << 1
+
 def is_terminal(symbol: str) -> bool:
     return not symbol.isupper()
 
@@ -44,128 +49,298 @@ class Grammar:
     def __init__(self, rules: Iterable[Tuple[str, str]]):
         self.rule_map = {}
         self.initial, _ = rules[0]
+        self._first_cache: Optional[Dict[str, int]] = None
+        self._follow_cache: Optional[Dict[str, int]] = None
+        self._sequence_first_cache: Dict[str, FrozenSet[str]] = {}
+        self._follow_set_cache: Dict[str, FrozenSet[str]] = {}
+        self._suffix_first_cache: Optional[Dict[Tuple[str, str], List[int]]] = None
         
         for head, body in rules:
             sequences = self.rule_map.setdefault(head, [])
             sequences.append(body)
 
-    @property
-    def nonterminals(self) -> Tuple[str]:
-        symbols = []
-        
-        symbols.extend(head for head in self.rule_map.keys() if head not in symbols)
+        # the rules and symbols of the grammar never change, so they are
+        # collected once
+        self._bodies = {head: tuple(sequences) for head, sequences in self.rule_map.items()}
+        self._rules = tuple(
+            (head, sequence)
+            for head, sequences in self._bodies.items()
+            for sequence in sequences
+        )
+
+        # dicts keep insertion order, so symbols are listed as they first appear
+        nonterminals = dict.fromkeys(self.rule_map)
+        nonterminals.update(dict.fromkeys(
+            s for _, sequence in self._rules for s in sequence if not is_terminal(s)
+        ))
 
-        for sequences in self.rule_map.values():
-            for sequence in sequences:
-                for s in sequence:
-                    if not is_terminal(s) and s not in symbols:
-                        symbols.append(s)
+        self._nonterminals = tuple(nonterminals)
+        self._nonterminal_set = frozenset(s for s in nonterminals if not is_terminal(s))
+
+        self._terminal_masks = {"&": EPSILON, "$": END}
+
+        for _, sequence in self._rules:
+            for s in sequence:
+                if is_terminal(s) and s not in self._terminal_masks:
+                    self._terminal_masks[s] = 1 << len(self._terminal_masks)
+
+        terminals = dict.fromkeys(
+            s for _, sequence in self._rules for s in sequence if is_terminal(s)
+        )
+        terminals.pop("&", None)
 
-        return tuple(symbols)
+        self._terminals = tuple(terminals)
 
     @property
-    def terminals(self) -> Tuple[str]:
-        symbols = []
-        
-        for sequences in self.rule_map.values():
-            for sequence in sequences:
-                for s in sequence:
-                    if is_terminal(s) and s not in symbols:
-                        symbols.append(s)
-        
-        if "&" in symbols:
-            symbols.remove("&")
+    def nonterminals(self) -> Tuple[str, ...]:
+        return self._nonterminals
 
-        return tuple(symbols)
+    @property
+    def terminals(self) -> Tuple[str, ...]:
+        return self._terminals
 
     @property
-    def rules(self) -> Iterable[Tuple[str, str]]:
-        for head, body in self.rule_map.items():
-            for sequence in body:
-                yield (head, sequence)
+    def rules(self) -> Tuple[Tuple[str, str], ...]:
+        return self._rules
 
     def get_body(self, non_terminal: str) -> Tuple[str, ...]:
-        return tuple(self.rule_map.get(non_terminal, ()))
+        return self._bodies.get(non_terminal, ())
     
-    def get_first(self, sequence: str, search_stack: Tuple[str, ...] = ()) -> FrozenSet[str]:
-        first_set = set()
+    def get_first(self, sequence: str) -> FrozenSet[str]:
+        first_set = self._sequence_first_cache.get(sequence)
+
+        if first_set is None:
+            first_set = self._terminals_of(self._first_mask(sequence))
+            self._sequence_first_cache[sequence] = first_set
+
+        return first_set
+
+    def _first_mask(self, sequence: str) -> int:
+        return self._first_of_sequence(sequence, self._get_firsts())
+
+    def _get_firsts(self) -> Dict[str, int]:
+        if self._first_cache is None:
+            self._first_cache = self._compute_firsts()
+
+        return self._first_cache
+
+    def _compute_firsts(self) -> Dict[str, int]:
+        first = {symbol: 0 for symbol in self.nonterminals}
+
+        # the first set of every head grows with the first of its bodies until
+        # no rule adds anything
+        changed = True
+        while changed:
+            changed = False
+
+            for head, body in self.rules:
+                head_first = first[head] | self._first_of_sequence(body, first)
+
+                if head_first != first[head]:
+                    first[head] = head_first
+                    changed = True
+
+        return first
+
+    def _first_of_sequence(self, sequence: str, first: Dict[str, int]) -> int:
+        first_mask = 0
 
         for symbol in sequence:
-            if is_terminal(symbol):
-                symbol_first_set = {symbol,}
-            else:
-                bodies = self.get_body(symbol)
-                first_of_bodies = [
-                    self.get_first(body, (body[0], *search_stack))
-                    for body in bodies if body[0] not in search_stack
-                ]
-                symbol_first_set = set(s for first in first_of_bodies for s in first)
+            symbol_mask = first[symbol] if symbol in self._nonterminal_set else self._terminal_masks[symbol]
 
-            first_set.update(symbol_first_set)
+            # the first symbol that does not derive '&' ends the sequence, and
+            # '&' only belongs to it when every symbol derives it
+            if not symbol_mask & EPSILON:
+                return first_mask & ~EPSILON | symbol_mask
 
-            if "&" not in symbol_first_set:
-                break
+            first_mask |= symbol_mask
     
-        return frozenset(first_set)
+        return first_mask
 
-    def get_follow(self, non_terminal: str, search_stack: Tuple[str, ...] = ()) -> FrozenSet[str]:
-        follow_set = set()
+    def _get_suffix_firsts(self) -> Dict[Tuple[str, str], List[int]]:
+        if self._suffix_first_cache is None:
+            self._suffix_first_cache = self._compute_suffix_firsts()
 
-        if non_terminal == self.initial:
-            follow_set.add("$")
-        
-        for head, sequence in self.rules:
-            for i, symbol in enumerate(sequence):
-                if symbol == non_terminal:
-                    rightside = sequence[i+1:]
-                    rightside_first = self.get_first(rightside)
-
-                    if rightside:
-                        follow_set.update(rightside_first)
-
-                    if not rightside or "&" in rightside_first:
-                        if head not in search_stack:
-                            follow_set.update(self.get_follow(head, (*search_stack, head)))
-        
-        return follow_set - {"&"}
+        return self._suffix_first_cache
+
+    def _compute_suffix_firsts(self) -> Dict[Tuple[str, str], List[int]]:
+        first = self._get_firsts()
+        suffix_firsts: Dict[Tuple[str, str], List[int]] = {}
+
+        for head, body in self.rules:
+            # first of body[i:] at index i, walking the body backwards. the empty
+            # rest of a body derives '&'
+            suffixes = [0] * len(body) + [EPSILON if body else 0]
+
+            for i in range(len(body) - 1, -1, -1):
+                symbol = body[i]
+                symbol_mask = first[symbol] if symbol in self._nonterminal_set else self._terminal_masks[symbol]
+
+                if symbol_mask & EPSILON:
+                    suffixes[i] = symbol_mask & ~EPSILON | suffixes[i + 1]
+                else:
+                    suffixes[i] = symbol_mask
+
+            suffix_firsts[(head, body)] = suffixes
+
+        return suffix_firsts
+
+    def _terminals_of(self, mask: int) -> FrozenSet[str]:
+        return frozenset(
+            terminal for terminal, terminal_mask in self._terminal_masks.items()
+            if mask & terminal_mask
+        )
+
+    def get_follow(self, non_terminal: str) -> FrozenSet[str]:
+        follow_set = self._follow_set_cache.get(non_terminal)
+
+        if follow_set is None:
+            follow_set = self._terminals_of(self._get_follows().get(non_terminal, 0))
+            self._follow_set_cache[non_terminal] = follow_set
+
+        return follow_set
+
+    def _get_follows(self) -> Dict[str, int]:
+        if self._follow_cache is None:
+            self._follow_cache = self._compute_follows()
+
+        return self._follow_cache
+
+    def _compute_follows(self) -> Dict[str, int]:
+        suffix_firsts = self._get_suffix_firsts()
+
+        follow = {symbol: 0 for symbol in self.nonterminals}
+        follow[self.initial] = END
+
+        # heads whose follow flows into a nonterminal, because the rest of the
+        # body after it derives '&'
+        inherited: List[Tuple[str, str]] = []
+
+        for head, body in self.rules:
+            suffixes = suffix_firsts[(head, body)]
+
+            for i, symbol in enumerate(body):
+                if symbol not in self._nonterminal_set:
+                    continue
+
+                rightside_first = suffixes[i + 1]
+                follow[symbol] |= rightside_first & ~EPSILON
+
+                if rightside_first & EPSILON:
+                    inherited.append((head, symbol))
+
+        changed = True
+        while changed:
+            changed = False
+
+            for head, symbol in inherited:
+                symbol_follow = follow[symbol] | follow[head]
+
+                if symbol_follow != follow[symbol]:
+                    follow[symbol] = symbol_follow
+                    changed = True
+
+        return follow
     
     def get_left_recursive_cycle(self):
-        stacks: List[Tuple[str, ...]] = []
+        first = self._get_firsts()
+
+        # edges from every head to the nonterminals that can start its bodies
+        left_corners: Dict[str, List[str]] = {symbol: [] for symbol in self.nonterminals}
+
+        for head, body in self.rules:
+            for symbol in body:
+                if symbol not in self._nonterminal_set:
+                    break
+
+                left_corners[head].append(symbol)
+
+                if not first[symbol] & EPSILON:
+                    break
+
+        # tarjan's strongly connected components over the nonterminals reachable
+        # from the initial symbol. a component with a cycle is left recursive
+        index: Dict[str, int] = {self.initial: 0}
+        lowlink: Dict[str, int] = {self.initial: 0}
+        component_stack: List[str] = [self.initial]
+        on_stack: Set[str] = {self.initial}
+        visiting: List[Tuple[str, Iterator[str]]] = [(self.initial, iter(left_corners[self.initial]))]
+
+        while visiting:
+            head, successors = visiting[-1]
+
+            for symbol in successors:
+                if symbol not in index:
+                    index[symbol] = lowlink[symbol] = len(index)
+                    component_stack.append(symbol)
+                    on_stack.add(symbol)
+                    visiting.append((symbol, iter(left_corners[symbol])))
+                    break
+
+                if symbol in on_stack:
+                    lowlink[head] = min(lowlink[head], index[symbol])
+            else:
+                visiting.pop()
 
-        stacks.append((self.initial,))
+                if visiting:
+                    parent, _ = visiting[-1]
+                    lowlink[parent] = min(lowlink[parent], lowlink[head])
 
-        while stacks:
-            nonterminal_stack = stacks.pop()
+                if lowlink[head] != index[head]:
+                    continue
 
-            head = nonterminal_stack[-1]
-            bodies = self.get_body(head)
+                component: Set[str] = set()
+                while head not in component:
+                    symbol = component_stack.pop()
+                    on_stack.discard(symbol)
+                    component.add(symbol)
 
-            for body in bodies:
-                for symbol in body:
-                    if is_terminal(symbol):
-                        break
-                                        
-                    if symbol in nonterminal_stack:
-                        return (*nonterminal_stack, symbol)
-                    
-                    next_stack = (*nonterminal_stack, symbol)
-                    if next_stack not in next_stack:
-                        stacks.append(next_stack)
-
-                    if "&" not in self.get_first(symbol):
-                        break
+                if len(component) > 1 or head in left_corners[head]:
+                    return self._find_derivation(left_corners)
 
         return False
+
+    def _find_derivation(self, left_corners: Dict[str, List[str]]) -> Tuple[str, ...]:
+        # depth first search from the initial symbol for the derivation
+        # initial => ... => X => ... => X. the left corners of a symbol are
+        # checked against the path before the last of them is expanded first.
+        # a symbol expanded once has no cycle below it, so it is not expanded again
+        path: List[str] = []
+        on_path: Set[str] = set()
+        expanded: Set[str] = set()
+        pending: List[Tuple[str, int]] = [(self.initial, 0)]
+
+        while pending:
+            head, depth = pending.pop()
+
+            if head in expanded:
+                continue
+
+            expanded.add(head)
+            on_path.difference_update(path[depth:])
+            del path[depth:]
+            path.append(head)
+            on_path.add(head)
+
+            for symbol in left_corners[head]:
+                if symbol in on_path:
+                    return (*path, symbol)
+
+                pending.append((symbol, depth + 1))
+
+        return ()
     
     def get_left_ambiguity(self):
+        suffix_firsts = self._get_suffix_firsts()
+
         for head in self.nonterminals:
             bodies = self.get_body(head)
 
             for i, a in enumerate(bodies):
                 for b in bodies[i+1:]:
-                    first_intersection = (self.get_first(a) & self.get_first(b)) - {"&"}
+                    first_intersection = suffix_firsts[(head, a)][0] & suffix_firsts[(head, b)][0] & ~EPSILON
                     if first_intersection:
-                        return (head, (a, b), first_intersection)
+                        return (head, (a, b), self._terminals_of(first_intersection))
 
     def generate_ll_table(self):
         if cycle := self.get_left_recursive_cycle():
@@ -175,24 +350,34 @@ class Grammar:
             head, (a, b), symbols = ambiguity
             raise GrammarException(f"Gramática não fatorada. Ambiguidade entre regras {head} => {a} e {head} => {b} pelo símbolo(s) {','.join(symbols)}.")
         
-        table: Dict[Tuple[str, str], int] = {}
+        return self.analyze()
 
-        follow = {symbol: self.get_follow(symbol) for symbol in self.nonterminals}
+    def analyze(self) -> Dict[Tuple[str, str], int]:
+        # FIRST, the FIRST of every body suffix and FOLLOW are each computed once,
+        # in this order, and the table is then filled in one walk over the rules.
+        # the LL(1) conditions are checked by generate_ll_table
+        self._get_firsts()
+        suffix_firsts = self._get_suffix_firsts()
+        follow = self._get_follows()
+
+        table: Dict[Tuple[str, str], int] = {}
 
         for i, (head, body) in enumerate(self.rules):
-            symbols = self.get_first(body)
+            symbols = suffix_firsts[(head, body)][0]
 
-            if "&" in symbols:
-                symbols = (symbols | follow[head])  - {"&"}
+            if symbols & EPSILON:
+                symbols = (symbols | follow[head]) & ~EPSILON
             
-            for symbol in symbols:
-                table[(head, symbol)] = i + 1
+            for symbol, symbol_mask in self._terminal_masks.items():
+                if symbols & symbol_mask:
+                    table[(head, symbol)] = i + 1
             
         return table
 
 
 def parse_grammar(input: str):
-    input = re.sub("\s", "", input)
+    # str.split drops every whitespace character, unicode ones included
+    input = "".join(input.split())
 
     rules_str = input.split(";")
     rules = [tuple(r.split("=")) for r in rules_str if r]
@@ -200,26 +385,42 @@ def parse_grammar(input: str):
     return Grammar(rules)
 
 
-def format_set(value: Iterable[Any]) -> str:
-    value_set = set(value)
-    alpha = sorted(el for el in value_set if str(el).isalpha())
+def format_set(value: Iterable[str]) -> str:
+    # letters come first, then the other symbols, each group sorted
+    alpha: List[str] = []
+    other: List[str] = []
 
-    ordered = alpha + list(value_set - set(alpha))
-    return "{" + ",".join(str(el) for el in ordered) + "}"
+    for el in value:
+        (alpha if el.isalpha() else other).append(el)
+
+    alpha.sort()
+    other.sort()
+    return "{" + ",".join(alpha + other) + "}"
 
 
 def format_ll_table(table: Dict[Tuple[str, str], int]) -> str:
     (initial, _), *_ = table.keys()
-    nonterminals = format_set(t for t, _ in table.keys())
-    terminals = format_set(s for _, s in table.keys())
-    entries = "".join(
-        sorted(
-            (f"[{t},{a},{i}]" for (t, a), i in table.items()),
-            key=lambda v: (ord(v[1]), ord(v[3]) + ord("z") * (not v[3].isalnum()) )
-        )
-    )
 
-    return ";".join((nonterminals, initial, terminals, entries))
+    nonterminals: Set[str] = set()
+    terminals: Set[str] = set()
+    entries: List[Tuple[Tuple[int, int], str]] = []
+
+    for (t, a), i in table.items():
+        nonterminals.add(t)
+        terminals.add(a)
+
+        # ordered by nonterminal, then symbol, with the non alphanumeric ones last
+        entry = f"[{t},{a},{i}]"
+        entries.append(((ord(entry[1]), ord(entry[3]) + ord("z") * (not entry[3].isalnum())), entry))
+
+    entries.sort(key=itemgetter(0))
+
+    return ";".join((
+        format_set(nonterminals),
+        initial,
+        format_set(terminals),
+        "".join(entry for _, entry in entries),
+    ))
 
 
 if __name__ == "__main__":